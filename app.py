@@ -1,44 +1,156 @@
 import os
+import queue
+import atexit
 import logging
+import logging.config
+import threading
+from logging.handlers import QueueHandler, QueueListener
+from cachetools import TTLCache
+from jinja2 import FileSystemBytecodeCache
 from flask import Flask
-from extensions import db, login_manager
+from sqlalchemy.orm import make_transient_to_detached
+from extensions import db, login_manager, OrjsonProvider
+# models.user only depends on extensions, so importing it here is not circular
+from models.user import User
 
-# Configure logging
-logging.basicConfig(level=logging.DEBUG)
 logger = logging.getLogger(__name__)
 
+# Settings read from the environment once at import, so repeated create_app()
+# calls (tests, the flask CLI) see one consistent snapshot.
+_CONFIG = {
+    "SESSION_SECRET": os.environ.get("SESSION_SECRET", "dev-secret-key"),
+    "DATABASE_URL": os.environ.get("DATABASE_URL"),
+    "LOG_LEVEL": os.environ.get("LOG_LEVEL", "INFO").upper(),
+    "FLASK_DEBUG": os.environ.get("FLASK_DEBUG") == "1",
+    "JINJA_CACHE_DIR": os.environ.get("JINJA_CACHE_DIR"),
+    "DB_POOL_SIZE": int(os.environ.get("DB_POOL_SIZE", "20")),
+    "DB_MAX_OVERFLOW": int(os.environ.get("DB_MAX_OVERFLOW", "10")),
+    "RUN_SCHEMA_INIT": os.environ.get("RUN_SCHEMA_INIT") == "1",
+}
+
+# Recently loaded users, keyed by id, so hot sessions skip the SELECT. Only
+# plain column values are cached; each request rebuilds its own User from
+# them, so no ORM instance is shared between sessions.
+_user_cache = TTLCache(maxsize=1024, ttl=30)
+_user_cache_lock = threading.Lock()
+_USER_CACHE_COLUMNS = ("id", "email", "name", "google_id")
+
+def load_user(user_id):
+    """Flask-Login user loader, called on every authenticated request"""
+    user_id = int(user_id)
+    with _user_cache_lock:
+        cached = _user_cache.get(user_id)
+    if cached is not None:
+        # A detached, unmodified User can be attached without querying
+        user = User(**cached)
+        make_transient_to_detached(user)
+        return db.session.merge(user, load=False)
+
+    # Session.get checks the identity map before issuing a SELECT
+    user = db.session.get(User, user_id)
+    if user is not None:
+        snapshot = {column: getattr(user, column) for column in _USER_CACHE_COLUMNS}
+        with _user_cache_lock:
+            _user_cache[user_id] = snapshot
+    return user
+
+def forget_user(user_id):
+    """Drop a user from the loader cache after logout or a profile change"""
+    with _user_cache_lock:
+        _user_cache.pop(int(user_id), None)
+
+class DeferredQueueHandler(QueueHandler):
+    """QueueHandler that leaves all formatting to the listener's handler"""
+
+    def prepare(self, record):
+        # The stdlib version renders the message and traceback here, on the
+        # logging thread, so records can be pickled. Our queue never leaves
+        # the process, so hand the record over untouched.
+        return record
+
+_log_listener = None
+
+def configure_logging():
+    """Configure logging from LOG_LEVEL (defaults to INFO), written off-thread"""
+    global _log_listener
+    if _log_listener is not None:
+        return
+
+    # Request threads only enqueue records; formatting and the stderr write
+    # happen on the listener's background thread.
+    log_queue = queue.Queue(-1)
+    logging.config.dictConfig({
+        "version": 1,
+        "disable_existing_loggers": False,
+        "handlers": {
+            "queue": {"()": DeferredQueueHandler, "queue": log_queue}
+        },
+        "root": {"level": _CONFIG["LOG_LEVEL"], "handlers": ["queue"]},
+        # urllib3 logs every pooled connection at DEBUG; keep it quiet
+        "loggers": {"urllib3": {"level": "WARNING"}}
+    })
+
+    stream_handler = logging.StreamHandler()
+    stream_handler.setFormatter(logging.Formatter(logging.BASIC_FORMAT))
+    _log_listener = QueueListener(log_queue, stream_handler)
+    _log_listener.start()
+    atexit.register(_log_listener.stop)
+
 def create_app():
+    configure_logging()
     app = Flask(__name__)
-    app.secret_key = os.environ.get("SESSION_SECRET", "dev-secret-key")
+    app.json = OrjsonProvider(app)
+    # Templates only change on deploy, so skip the per-render mtime check
+    app.config["TEMPLATES_AUTO_RELOAD"] = _CONFIG["FLASK_DEBUG"]
+    # Reuse compiled templates across worker restarts instead of re-parsing
+    app.jinja_env.bytecode_cache = FileSystemBytecodeCache(_CONFIG["JINJA_CACHE_DIR"])
+    app.secret_key = _CONFIG["SESSION_SECRET"]
 
     # Configure SQLAlchemy with SQLite fallback
     logger.debug("Configuring database connection...")
-    database_url = os.environ.get("DATABASE_URL") or "sqlite:///local.db"
-    logger.info(f"Using database: {database_url}")
+    database_url = _CONFIG["DATABASE_URL"] or "sqlite:///local.db"
+    logger.info("Using database: %s", database_url)
     app.config["SQLALCHEMY_DATABASE_URI"] = database_url
+    app.config["SQLALCHEMY_TRACK_MODIFICATIONS"] = False
     app.config["SQLALCHEMY_ENGINE_OPTIONS"] = {
-        "pool_recycle": 300,
+        "pool_recycle": 1800,
         "pool_pre_ping": True,
+        # Sized for concurrent OAuth callbacks on gevent workers
+        "pool_size": _CONFIG["DB_POOL_SIZE"],
+        "max_overflow": _CONFIG["DB_MAX_OVERFLOW"],
+        "pool_timeout": 30,
+        # Room for every compiled statement the app issues, so none get evicted
+        "query_cache_size": 1200,
     }
 
     # Initialize extensions
     db.init_app(app)
     login_manager.init_app(app)
     login_manager.login_view = 'auth.login'
-
-    @login_manager.user_loader
-    def load_user(user_id):
-        # Import User model here to avoid circular imports
-        from models.user import User
-        return User.query.get(int(user_id))
+    login_manager.user_loader(load_user)
 
     # Register blueprints
-    from blueprints.auth import auth as auth_blueprint
-    app.register_blueprint(auth_blueprint, url_prefix='/auth')
+    from blueprints.auth import auth as auth_blueprint, prefetch_google_documents
+    app.register_blueprint(auth_blueprint)
 
-    # Create database tables
-    with app.app_context():
-        from models.user import User  # Import here after db is set up
+    # Fetch Google's ID token signing certs up front without blocking startup
+    threading.Thread(target=prefetch_google_documents, daemon=True).start()
+
+    @app.cli.command("init-db")
+    def init_db():
+        """Create any missing database tables."""
         db.create_all()
+        logger.info("Database tables created")
+
+    # Creating tables is a one-off deploy step (`flask --app main init-db` in
+    # the deployment build, so autoscaled instances never race on it); only
+    # the local SQLite fallback or RUN_SCHEMA_INIT=1 does it on boot.
+    if _CONFIG["RUN_SCHEMA_INIT"] or not _CONFIG["DATABASE_URL"]:
+        with app.app_context():
+            db.create_all()
+
+    # Compile the main pages now rather than on each worker's first request
+    for template in ("index.html", "login.html"):
+        app.jinja_env.get_template(template)
 
     return app
\ No newline at end of file
@@ -1,27 +1,191 @@
 import os
+import re
+import hmac
+import secrets
+import time
+import functools
+import threading
+import logging
+from urllib.parse import urlencode
+import orjson
 import requests
-from flask import Blueprint, redirect, url_for, render_template, request, session, jsonify
+from flask import Blueprint, redirect, url_for, render_template, request, session, jsonify, current_app
+from itsdangerous import URLSafeTimedSerializer, BadSignature
 from flask_login import login_user, current_user, logout_user
-from google_auth_oauthlib.flow import Flow
-from app import db
+from app import db, forget_user
 from models.user import User
-from services.calendar_service import CalendarService
+from services.calendar_service import CalendarService, get_calendar_service
+from services import http_pool
 
-auth = Blueprint('auth', __name__, template_folder='../templates')
+# Templates come from the app's own templates/ folder
+auth = Blueprint('auth', __name__, url_prefix='/auth')
 
 GOOGLE_CLIENT_ID = os.environ.get("GOOGLE_CLIENT_ID")
 GOOGLE_CLIENT_SECRET = os.environ.get("GOOGLE_CLIENT_SECRET")
-GOOGLE_DISCOVERY_URL = "https://accounts.google.com/.well-known/openid-configuration"
 REPLIT_DOMAIN = "ai-travel-buddy-bboyswagat.replit.app"
 
-# Initialize calendar service at blueprint level
-calendar_service = CalendarService()
+logger = logging.getLogger(__name__)
+
+GOOGLE_OAUTH_CONFIGURED = bool(GOOGLE_CLIENT_ID and GOOGLE_CLIENT_SECRET)
+if not GOOGLE_OAUTH_CONFIGURED:
+    logger.error("GOOGLE_CLIENT_ID and GOOGLE_CLIENT_SECRET must be set for Google sign-in")
+
+# OAuth client settings are static for the life of the process, so build them
+# once instead of on every login/callback.
+# OAUTH_REDIRECT_URI must match the Google console registration byte-for-byte
+_REDIRECT_URI = os.environ.get("OAUTH_REDIRECT_URI", f"https://{REPLIT_DOMAIN}/auth/google_callback")
+
+# Use full scope URLs as required by Google OAuth
+_AUTH_SCOPES = (
+    'openid',
+    'https://www.googleapis.com/auth/userinfo.email',
+    'https://www.googleapis.com/auth/userinfo.profile'
+)
+
+_CLIENT_CONFIG = {
+    "web": {
+        "client_id": GOOGLE_CLIENT_ID,
+        "client_secret": GOOGLE_CLIENT_SECRET,
+        "auth_uri": "https://accounts.google.com/o/oauth2/auth",
+        "token_uri": "https://oauth2.googleapis.com/token",
+        "redirect_uris": [_REDIRECT_URI]
+    }
+}
+
+# Everything in the login authorization URL except the state is fixed, so
+# /google_login only appends a fresh state instead of building a Flow.
+_AUTH_URL_BASE = _CLIENT_CONFIG["web"]["auth_uri"] + "?" + urlencode({
+    "response_type": "code",
+    "client_id": GOOGLE_CLIENT_ID or "",
+    "redirect_uri": _REDIRECT_URI,
+    "scope": " ".join(_AUTH_SCOPES),
+    "access_type": "offline",
+    "include_granted_scopes": "false",  # Don't include additional scopes
+    "prompt": "consent"
+})
+
+# The login state travels in a short-lived signed cookie rather than the session
+OAUTH_STATE_COOKIE = 'oauth_state'
+OAUTH_STATE_MAX_AGE = 300
+# Login state carries this prefix; calendar state uses CalendarService's
+AUTH_STATE_PREFIX = 'auth:'
+# Script-readable flag set once calendar credentials are stored; the page
+# keys its (browser-cached) calendar status request on it
+CALENDAR_FLAG_COOKIE = 'gcal_auth'
+
+# Google's ID token signing certs rarely change; keep a parsed copy
+# in-process for as long as their Cache-Control headers allow.
+GOOGLE_CERTS_URL = "https://www.googleapis.com/oauth2/v1/certs"
+# Google signs ID tokens with either form of its issuer
+GOOGLE_ISSUERS = ('accounts.google.com', 'https://accounts.google.com')
+DEFAULT_CACHE_TTL = 3600
+STALE_RETRY_SECONDS = 60
+_CERTS_CACHE = {"doc": None, "expires": 0.0}
+_GOOGLE_CACHE_LOCK = threading.Lock()
+_MAX_AGE_RE = re.compile(r'max-age=(\d+)')
+
+# Shared keep-alive session so Google calls reuse pooled TLS connections
+# across logins instead of handshaking on every request.
+_http = http_pool.new_session()
+# Every Google endpoint we call returns JSON; set it once for all requests
+_http.headers.update({"Accept": "application/json"})
+
+@functools.lru_cache(maxsize=32)
+def _endpoint_url(endpoint: str, script_root: str) -> str:
+    """url_for for argument-less endpoints, memoized per mount point"""
+    return url_for(endpoint)
+
+def _redirect_to(endpoint: str):
+    """Redirect to a fixed endpoint without rebuilding its URL every time"""
+    return redirect(_endpoint_url(endpoint, request.script_root))
+
+def _cache_ttl(response) -> int:
+    """Return the max-age advertised by the response, or the default TTL"""
+    match = _MAX_AGE_RE.search(response.headers.get('Cache-Control', ''))
+    return int(match.group(1)) if match else DEFAULT_CACHE_TTL
+
+def _state_serializer() -> URLSafeTimedSerializer:
+    return URLSafeTimedSerializer(current_app.secret_key, salt='oauth-state')
+
+def _get_cached_json(url: str, cache: dict) -> dict:
+    """Return the JSON document at url, fetching it at most once per TTL"""
+    if time.monotonic() < cache["expires"]:
+        return cache["doc"]
+
+    with _GOOGLE_CACHE_LOCK:
+        # Another thread may have refreshed the document while we waited
+        if time.monotonic() < cache["expires"]:
+            return cache["doc"]
+
+        logger.debug("Fetching %s", url)
+        try:
+            response = _http.get(url, timeout=5)
+            response.raise_for_status()
+        except requests.RequestException as e:
+            if cache["doc"] is None:
+                raise
+            # Keep serving the last good copy rather than failing logins
+            logger.warning("Refreshing %s failed, reusing cached copy: %s", url, e)
+            cache["expires"] = time.monotonic() + STALE_RETRY_SECONDS
+            return cache["doc"]
+
+        cache["doc"] = orjson.loads(response.content)
+        cache["expires"] = time.monotonic() + _cache_ttl(response)
+        return cache["doc"]
+
+def get_google_certs() -> dict:
+    """Return Google's ID token signing certificates keyed by key ID"""
+    return _get_cached_json(GOOGLE_CERTS_URL, _CERTS_CACHE)
+
+def prefetch_google_documents():
+    """Warm the certificate cache before the first login"""
+    try:
+        get_google_certs()
+    except Exception as e:
+        logger.warning("Could not prefetch Google signing certs: %s", e)
+
+def verify_google_id_token(token: str) -> dict:
+    """Verify a Google ID token locally and return its claims"""
+    from google.auth import jwt
+
+    claims = jwt.decode(token, certs=get_google_certs(), audience=GOOGLE_CLIENT_ID)
+    if claims.get('iss') not in GOOGLE_ISSUERS:
+        raise ValueError(f"Unexpected ID token issuer: {claims.get('iss')}")
+    return claims
+
+def _upsert_user(email: str, name: str, google_id: str) -> User:
+    """Insert the user on first login, or refresh their row, in one statement"""
+    dialect = db.engine.dialect.name
+    if dialect == 'postgresql':
+        from sqlalchemy.dialects.postgresql import insert
+    elif dialect == 'sqlite':
+        from sqlalchemy.dialects.sqlite import insert
+    else:
+        user = User.query.filter_by(email=email).first()
+        if not user:
+            user = User(email=email, name=name, google_id=google_id)
+            db.session.add(user)
+            db.session.commit()
+        return user
+
+    # ON CONFLICT also closes the race between concurrent first logins
+    stmt = insert(User).values(email=email, name=name, google_id=google_id)
+    stmt = stmt.on_conflict_do_update(
+        index_elements=['email'],
+        set_={
+            'name': db.func.coalesce(stmt.excluded.name, User.__table__.c.name),
+            'last_login': db.func.now()
+        }
+    ).returning(User)
+    user = db.session.scalars(stmt, execution_options={"populate_existing": True}).one()
+    db.session.commit()
+    return user
 
 @auth.route('/login')
 def login():
     """Renders login page with the 'Sign in with Google' button."""
     if current_user.is_authenticated:
-        return redirect(url_for('index'))
+        return _redirect_to('index')
     return render_template("login.html")
 
 @auth.route('/google_login')
@@ -30,110 +194,86 @@ def google_login():
     Initiates Google OAuth flow for authentication (NOT calendar).
     Uses only authentication scopes: 'openid', 'email', 'profile'
     """
-    # Auth-specific callback URL
-    redirect_uri = f"https://{REPLIT_DOMAIN}/auth/google_callback"
-
-    # Use full scope URLs as required by Google OAuth
-    auth_scopes = [
-        'openid',
-        'https://www.googleapis.com/auth/userinfo.email',
-        'https://www.googleapis.com/auth/userinfo.profile'
-    ]
-
-    flow = Flow.from_client_config(
-        {
-            "web": {
-                "client_id": GOOGLE_CLIENT_ID,
-                "client_secret": GOOGLE_CLIENT_SECRET,
-                "auth_uri": "https://accounts.google.com/o/oauth2/auth",
-                "token_uri": "https://oauth2.googleapis.com/token",
-                "redirect_uris": [redirect_uri]
-            }
-        },
-        scopes=auth_scopes
-    )
+    if not GOOGLE_OAUTH_CONFIGURED:
+        return "Google sign-in is not configured", 503
 
-    flow.redirect_uri = redirect_uri
-
-    authorization_url, state = flow.authorization_url(
-        access_type='offline',
-        include_granted_scopes='false',  # Don't include additional scopes
-        prompt='consent'
+    state = AUTH_STATE_PREFIX + _state_serializer().dumps(secrets.token_urlsafe(16))
+    response = redirect(f"{_AUTH_URL_BASE}&{urlencode({'state': state})}")
+    response.set_cookie(
+        OAUTH_STATE_COOKIE,
+        state,
+        max_age=OAUTH_STATE_MAX_AGE,
+        secure=True,
+        httponly=True,
+        samesite='Lax'
     )
-
-    session['oauth_state'] = state
-    return redirect(authorization_url)
+    return response
 
 @auth.route('/google_callback')
 def google_callback():
     """
     Handle callbacks for both authentication and calendar authorization.
     """
-    calendar_state = session.get('calendar_oauth_state')
-    auth_state = session.get('oauth_state')
+    # The state parameter's prefix says which flow this callback belongs to
+    returned_state = request.args.get('state', '')
 
     # Handle calendar callback
-    if calendar_state:
+    if returned_state.startswith(CalendarService.STATE_PREFIX):
+        calendar_state = session.get('calendar_oauth_state', '')
+        if not hmac.compare_digest(calendar_state.encode(), returned_state.encode()):
+            return "Invalid callback state", 400
         try:
-            if not calendar_service.check_availability():
+            if not get_calendar_service().check_availability():
                 return jsonify({
                     "status": "error",
                     "message": "Calendar integration is not configured"
                 }), 503
 
-            creds = calendar_service.verify_oauth2_callback(request.url, calendar_state)
+            creds = get_calendar_service().verify_oauth2_callback(request.url, calendar_state)
             session["google_calendar_credentials"] = creds
             session.pop("calendar_oauth_state", None)  # Clear the state
-            return redirect(url_for("index"))
+            response = _redirect_to('index')
+            # Only a UI hint, so it follows the request's scheme; a Secure-only
+            # cookie would never be stored by the http dev server
+            response.set_cookie(CALENDAR_FLAG_COOKIE, '1', secure=request.is_secure, httponly=False, samesite='Lax')
+            return response
         except Exception as e:
             return jsonify({"status": "error", "message": str(e)}), 500
 
     # Handle authentication callback
-    elif auth_state:
+    elif returned_state.startswith(AUTH_STATE_PREFIX):
+        from google_auth_oauthlib.flow import Flow
+
+        auth_state = request.cookies.get(OAUTH_STATE_COOKIE, '')
+        if not hmac.compare_digest(auth_state.encode(), returned_state.encode()):
+            return "Invalid callback state", 400
+        try:
+            _state_serializer().loads(auth_state[len(AUTH_STATE_PREFIX):], max_age=OAUTH_STATE_MAX_AGE)
+        except BadSignature:
+            return "Login attempt expired, please try again", 400
+
         try:
-            redirect_uri = f"https://{REPLIT_DOMAIN}/auth/google_callback"
-            flow = Flow.from_client_config(
-                {
-                    "web": {
-                        "client_id": GOOGLE_CLIENT_ID,
-                        "client_secret": GOOGLE_CLIENT_SECRET,
-                        "auth_uri": "https://accounts.google.com/o/oauth2/auth",
-                        "token_uri": "https://oauth2.googleapis.com/token",
-                        "redirect_uris": [redirect_uri]
-                    }
-                },
-                scopes=['openid', 'https://www.googleapis.com/auth/userinfo.email', 'https://www.googleapis.com/auth/userinfo.profile'],
-                state=auth_state
-            )
-
-            flow.redirect_uri = redirect_uri
+            flow = Flow.from_client_config(_CLIENT_CONFIG, scopes=_AUTH_SCOPES, state=auth_state)
+            flow.redirect_uri = _REDIRECT_URI
+            # Let the token exchange reuse our pooled connections too
+            flow.oauth2session.mount("https://", http_pool.https_adapter)
             flow.fetch_token(authorization_response=request.url)
             credentials = flow.credentials
 
-            userinfo_url = "https://www.googleapis.com/oauth2/v2/userinfo"
-            headers = {"Authorization": f"Bearer {credentials.token}"}
-            response = requests.get(userinfo_url, headers=headers)
-
-            if response.status_code != 200:
-                return f"Failed to get user info: {response.text}", 400
-
-            userinfo = response.json()
+            # The token response already carries the user's identity, so
+            # verify the ID token locally instead of calling userinfo.
+            userinfo = verify_google_id_token(credentials.id_token)
             email = userinfo.get('email')
-            if not email:
+            if not email or not userinfo.get('email_verified'):
                 return "Could not get user email", 400
 
-            user = User.query.filter_by(email=email).first()
-            if not user:
-                user = User(
-                    email=email,
-                    name=userinfo.get('name'),
-                    google_id=userinfo.get('id')
-                )
-                db.session.add(user)
-                db.session.commit()
+            user = _upsert_user(email, userinfo.get('name'), userinfo.get('sub'))
 
+            forget_user(user.id)
             login_user(user)
-            return redirect(url_for('index'))
+            response = _redirect_to('index')
+            response.delete_cookie(OAUTH_STATE_COOKIE)
+            return response
 
         except Exception as e:
             return f"Error in OAuth callback: {str(e)}", 400
@@ -143,5 +283,9 @@ def google_callback():
 @auth.route('/logout')
 def logout():
     """Logout current user."""
+    if current_user.is_authenticated:
+        forget_user(current_user.id)
     logout_user()
-    return redirect(url_for('auth.login'))
\ No newline at end of file
+    response = _redirect_to('auth.login')
+    response.delete_cookie(CALENDAR_FLAG_COOKIE, secure=request.is_secure, samesite='Lax')
+    return response
\ No newline at end of file
@@ -1,16 +1,18 @@
 import os
 
+# Read every variable we need from the environment once
+env_vars = ['REPLIT_SLUG', 'REPL_ID', 'REPLIT_DEV_DOMAIN', 'REPL_SLUG', 'REPL_OWNER']
+env = {var: os.environ.get(var) for var in env_vars}
+
 # Print all relevant environment variables for debugging
 print("\nAvailable Environment Variables:")
 print("================================")
-env_vars = ['REPLIT_SLUG', 'REPL_ID', 'REPLIT_DEV_DOMAIN', 'REPL_SLUG', 'REPL_OWNER']
-for var in env_vars:
-    value = os.environ.get(var)
+for var, value in env.items():
     print(f"{var}: {value if value else 'Not set'}")
 
 # Get primary domain components
-replit_slug = os.environ.get('REPLIT_SLUG', '')
-repl_id = os.environ.get('REPL_ID', '')
+replit_slug = env['REPLIT_SLUG'] or ''
+repl_id = env['REPL_ID'] or ''
 replit_domain = f"{replit_slug}.{repl_id}.repl.co" if replit_slug and repl_id else None
 
 print("\nGoogle OAuth Configuration Settings:")
@@ -27,7 +29,7 @@ if replit_domain:
     print(f"https://{replit_domain}/auth/google_callback")
 
 # Alternative domain check using REPLIT_DEV_DOMAIN
-dev_domain = os.environ.get('REPLIT_DEV_DOMAIN')
+dev_domain = env['REPLIT_DEV_DOMAIN']
 if dev_domain:
     print("\nAlternative Domain Configuration:")
     print("================================")
@@ -1,3 +1,5 @@
+import orjson
+from flask.json.provider import DefaultJSONProvider
 from flask_sqlalchemy import SQLAlchemy
 from flask_login import LoginManager
 from sqlalchemy.orm import DeclarativeBase
@@ -5,5 +7,21 @@ from sqlalchemy.orm import DeclarativeBase
 class Base(DeclarativeBase):
     pass
 
-db = SQLAlchemy(model_class=Base)
+# Request handlers never reuse objects after a commit expecting fresh rows,
+# so skip the post-commit expiry (and the refresh SELECT it would trigger).
+db = SQLAlchemy(
+    model_class=Base,
+    session_options={"expire_on_commit": False, "autoflush": False},
+)
 login_manager = LoginManager()
+
+class OrjsonProvider(DefaultJSONProvider):
+    """Flask JSON provider backed by orjson for jsonify and request.get_json"""
+
+    def dumps(self, obj, **kwargs):
+        # Formatting kwargs (indent, sort_keys) are ignored; output is compact.
+        # Types orjson can't handle natively fall back to Flask's default().
+        return orjson.dumps(obj, default=self.default, option=orjson.OPT_NON_STR_KEYS).decode()
+
+    def loads(self, s, **kwargs):
+        return orjson.loads(s)
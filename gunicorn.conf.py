@@ -0,0 +1,37 @@
+"""Gunicorn settings for the deployed app (`gunicorn -c gunicorn.conf.py main:app`)"""
+import os
+
+bind = f"0.0.0.0:{os.environ.get('PORT', '5000')}"
+
+# gevent workers monkey-patch sockets on boot, so a worker keeps serving other
+# requests while one waits on Google's OAuth endpoints, OpenAI or Airtable.
+worker_class = "gevent"
+workers = int(os.environ.get("WEB_CONCURRENCY", "2"))
+worker_connections = int(os.environ.get("WORKER_CONNECTIONS", "1000"))
+
+# OpenAI plan generation can take well over gunicorn's 30s default
+timeout = int(os.environ.get("GUNICORN_TIMEOUT", "120"))
+keepalive = 5
+
+
+def post_fork(server, worker):
+    """Make psycopg2 yield to other greenlets while waiting on Postgres"""
+    # psycopg2 is a C extension that gevent's monkey-patching can't reach;
+    # wait_select routes its socket waits through the (patched) select module.
+    import psycopg2.extensions
+    import psycopg2.extras
+    psycopg2.extensions.set_wait_callback(psycopg2.extras.wait_select)
+
+
+def post_worker_init(worker):
+    """Build the Airtable client before the worker's first request needs it"""
+    import threading
+    from services.airtable_service import get_airtable_service
+
+    def warm():
+        try:
+            get_airtable_service()
+        except Exception as e:
+            worker.log.warning("Airtable warm-up failed: %s", e)
+
+    threading.Thread(target=warm, daemon=True).start()
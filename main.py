@@ -1,9 +1,7 @@
 import logging
-from app import create_app
+from app import create_app, _CONFIG
 from routes import register_routes
 
-# Set up logging
-logging.basicConfig(level=logging.DEBUG)
 logger = logging.getLogger(__name__)
 
 # Create and configure the app
@@ -12,4 +10,5 @@ register_routes(app)
 
 if __name__ == "__main__":
     logger.info("Starting Flask server...")
-    app.run(host='0.0.0.0', port=5000, debug=True)
\ No newline at end of file
+    # Debugger and reloader are opt-in for local development only
+    app.run(host='0.0.0.0', port=5000, debug=_CONFIG["FLASK_DEBUG"])
\ No newline at end of file
@@ -3,11 +3,13 @@ from extensions import db
 
 class User(UserMixin, db.Model):
     id = db.Column(db.Integer, primary_key=True)
-    email = db.Column(db.String(120), unique=True, nullable=False)
+    email = db.Column(db.String(254), unique=True, index=True, nullable=False)
     name = db.Column(db.String(120))
-    google_id = db.Column(db.String(30), unique=True)
-    created_at = db.Column(db.DateTime, server_default=db.func.now())
-    last_login = db.Column(db.DateTime, server_default=db.func.now(), onupdate=db.func.now())
+    google_id = db.Column(db.String(32), unique=True, index=True)
+    # Audit timestamps are never read on the request path; keep them out of
+    # the SELECT that load_user runs on every authenticated request.
+    created_at = db.deferred(db.Column(db.DateTime, server_default=db.func.now()))
+    last_login = db.deferred(db.Column(db.DateTime, server_default=db.func.now(), onupdate=db.func.now()))
 
     def __repr__(self):
         return f'<User {self.email}>'
\ No newline at end of file
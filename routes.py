@@ -1,290 +1,374 @@
 import logging
-from flask import request, jsonify, render_template, redirect, session, url_for
+import hashlib
+import threading
+from concurrent.futures import Future
+from cachetools import TTLCache
+import click
+import orjson
+import msgspec
+from flask import request, jsonify, render_template, redirect, session, url_for, current_app, Response, stream_with_context
 from flask_login import login_required, current_user
-from services.airtable_service import AirtableService
-from services.openai_service import generate_travel_plan, analyze_user_preferences
-from services.calendar_service import CalendarService
+from werkzeug.exceptions import HTTPException
+from openai import RateLimitError
+from schemas import ChatRequest, PreferencesRequest, SelectPlanRequest, CalendarAddRequest
+from services.airtable_service import get_airtable_service
+from services.openai_service import DEFAULT_MODEL, generate_travel_plan, stream_travel_plan, split_travel_plans
+from services.calendar_service import get_calendar_service
+from services import preference_cache
 
-logging.basicConfig(level=logging.DEBUG)
 logger = logging.getLogger(__name__)
 
+def get_cached_preferences(user_id: str):
+    """Return a user's preferences (or None), cached for up to five minutes"""
+    return preference_cache.get_or_load(
+        user_id, lambda uid: get_airtable_service().get_user_preferences(uid)
+    )
+
+class APIError(Exception):
+    """An error reported to the client as JSON with an HTTP status"""
+
+    def __init__(self, message: str, status_code: int = 400):
+        super().__init__(message)
+        self.message = message
+        self.status_code = status_code
+
+# Travel requests are a few sentences; anything longer is rejected before it
+# can turn into an oversized (and expensive) OpenAI prompt.
+MAX_MESSAGE_BYTES = 4096
+
+# Identical prompts (same message, preferences and model) get the same plan
+# back for an hour instead of another multi-second OpenAI call.
+_plan_cache = TTLCache(maxsize=1024, ttl=3600)
+_plan_cache_lock = threading.Lock()
+
+def _plan_cache_key(message: str, prefs: dict) -> str:
+    """Stable hash of everything that shapes a generated plan"""
+    payload = orjson.dumps({"m": message, "p": prefs, "v": DEFAULT_MODEL}, option=orjson.OPT_SORT_KEYS)
+    return hashlib.blake2b(payload, digest_size=16).hexdigest()
+
+def _get_cached_plan(key: str):
+    """Return the cached plan for key, or None (always None with ?nocache=1)"""
+    if request.args.get("nocache") == "1":
+        return None
+    with _plan_cache_lock:
+        return _plan_cache.get(key)
+
+def _store_plan(key: str, result: dict):
+    """Remember a generated plan under its prompt hash"""
+    with _plan_cache_lock:
+        _plan_cache[key] = result
+
+def _decode_body(schema, error_message: str | None = None):
+    """Decode the JSON body directly into a msgspec schema, or fail with a 400"""
+    try:
+        return msgspec.json.decode(request.get_data(cache=False), type=schema)
+    except msgspec.DecodeError as e:  # includes ValidationError
+        raise APIError(error_message or f"Invalid request body: {e}") from e
+
+# Identical plan requests that arrive while one is already being generated
+# wait for that result instead of making their own OpenAI call.
+_inflight_plans: dict[str, Future] = {}
+_inflight_lock = threading.Lock()
+
+def _generate_plan_once(cache_key: str, message: str, prefs: dict) -> dict:
+    """Generate and cache a plan, sharing one OpenAI call per in-flight prompt"""
+    with _inflight_lock:
+        future = _inflight_plans.get(cache_key)
+        is_leader = future is None
+        if is_leader:
+            future = _inflight_plans[cache_key] = Future()
+    if not is_leader:
+        return future.result(timeout=120)
+
+    try:
+        result = generate_travel_plan(message, prefs)
+        _store_plan(cache_key, result)
+        future.set_result(result)
+        return result
+    except Exception as e:
+        future.set_exception(e)
+        raise
+    finally:
+        with _inflight_lock:
+            _inflight_plans.pop(cache_key, None)
+
+def _chat_message() -> str:
+    """Decode and validate the chat message from the request body"""
+    if not request.is_json:
+        raise APIError("Request must be JSON")
+    message = _decode_body(ChatRequest).message.strip()
+    if not message:
+        raise APIError("Message cannot be empty")
+    if len(message.encode()) > MAX_MESSAGE_BYTES:
+        raise APIError(f"Message is too long (limit {MAX_MESSAGE_BYTES} bytes)", 413)
+    return message
+
+def _chat_preferences() -> dict:
+    """Current user's preferences for plan generation; {} if unavailable"""
+    try:
+        return get_cached_preferences(str(current_user.id)) or {}
+    except Exception as e:
+        logger.warning("Failed to fetch preferences: %s", e)
+        return {}
+
+def _sse(event: str, payload: dict) -> bytes:
+    """Format one server-sent event with a JSON payload"""
+    return b"event: " + event.encode() + b"\ndata: " + orjson.dumps(payload) + b"\n\n"
+
+def _stream_plan_response(message: str, prefs: dict, cache_key: str) -> Response:
+    """Stream a travel plan as 'delta' events, ending with a 'done' event"""
+    cached = _get_cached_plan(cache_key)
+
+    def events():
+        if cached is not None:
+            yield _sse("done", cached)
+            return
+        parts = []
+        try:
+            for delta in stream_travel_plan(message, prefs):
+                parts.append(delta)
+                yield _sse("delta", {"content": delta})
+        except Exception as e:
+            logger.error("Travel plan stream error: %s", e)
+            yield _sse("error", {"status": "error", "message": str(e)})
+            return
+        # Finish with the same payload the JSON response carries
+        result = split_travel_plans("".join(parts))
+        _store_plan(cache_key, result)
+        yield _sse("done", result)
+
+    return Response(
+        stream_with_context(events()),
+        mimetype="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+    )
+
+# index.html has no per-user content, so it is rendered once per mount point
+_index_pages: dict[str, tuple[bytes, str]] = {}
+
+def _index_page() -> tuple[bytes, str]:
+    """Return the rendered index.html and its ETag, re-rendering only in debug"""
+    page = _index_pages.get(request.script_root)
+    if page is None or current_app.debug:
+        body = render_template("index.html").encode()
+        page = (body, hashlib.blake2b(body, digest_size=16).hexdigest())
+        _index_pages[request.script_root] = page
+    return page
+
 def register_routes(app):
     """Register all non-auth routes with the Flask app"""
     logger.debug("Registering main application routes...")
 
-    # Initialize services
-    airtable_service = AirtableService()
-    calendar_service = CalendarService()
-
     @app.errorhandler(404)
     def not_found(e):
         """Return JSON for HTTP 404 errors."""
-        logger.error(f"404 error: {request.url}")
+        logger.warning("404 error: %s", request.url)
         return jsonify({"status": "error", "message": "Resource not found"}), 404
 
+    @app.errorhandler(APIError)
+    def handle_api_error(e):
+        """Return JSON for errors a route raised deliberately."""
+        return jsonify({"status": "error", "message": e.message}), e.status_code
+
+    @app.errorhandler(RateLimitError)
+    def handle_rate_limit(e):
+        """Tell the client to back off when OpenAI is throttling us."""
+        # Expected under load; a traceback adds nothing here
+        logger.warning("OpenAI rate limit reached: %s", e)
+        return jsonify({
+            "status": "error",
+            "message": "Service is experiencing high traffic. Please try again in a few minutes."
+        }), 429
+
     @app.errorhandler(Exception)
     def handle_exception(e):
         """Return JSON instead of HTML for any error."""
-        logger.error(f"Unhandled exception: {str(e)}", exc_info=True)
+        if isinstance(e, HTTPException):
+            return jsonify({"status": "error", "message": e.description}), e.code
+        logger.exception("Unhandled exception: %s", e)
         return jsonify({"status": "error", "message": str(e)}), 500
 
     @app.route("/api/chat", methods=["POST"])
     @login_required
     def chat():
         """Handle user chat message to generate itinerary plan."""
-        try:
-            logger.debug("Received chat request")
-
-            if not request.is_json:
-                return jsonify({
-                    "status": "error",
-                    "message": "Request must be JSON"
-                }), 400
-
-            data = request.get_json()
-            message = data.get("message", "").strip()
-
-            if not message:
-                return jsonify({
-                    "status": "error",
-                    "message": "Message cannot be empty"
-                }), 400
-
-            # Get user preferences
-            prefs = {}
-            try:
-                user_prefs = airtable_service.get_user_preferences(str(current_user.id))
-                if user_prefs:
-                    prefs = user_prefs
-            except Exception as e:
-                logger.warning(f"Failed to fetch preferences: {e}")
-
-            # Generate travel plan
-            try:
-                result = generate_travel_plan(message, prefs)
-                return jsonify(result)
-            except Exception as e:
-                logger.error(f"Travel plan generation error: {str(e)}")
-                return jsonify({
-                    "status": "error",
-                    "message": str(e)
-                }), 500
+        logger.debug("Received chat request")
+        message = _chat_message()
 
-        except Exception as e:
-            logger.error(f"Chat endpoint error: {str(e)}")
-            return jsonify({
-                "status": "error",
-                "message": "An unexpected error occurred"
-            }), 500
+        # Get user preferences
+        prefs = _chat_preferences()
+        cache_key = _plan_cache_key(message, prefs)
+
+        # Generate travel plan
+        result = _get_cached_plan(cache_key)
+        if result is None:
+            result = _generate_plan_once(cache_key, message, prefs)
+        return jsonify(result)
+
+    @app.route("/api/chat/stream", methods=["POST"])
+    @login_required
+    def chat_stream():
+        """Stream the itinerary plan to the client as server-sent events."""
+        message = _chat_message()
+
+        prefs = _chat_preferences()
+        return _stream_plan_response(message, prefs, _plan_cache_key(message, prefs))
 
     @app.route("/api/calendar/status")
     @login_required
     def calendar_status():
         """Check Google Calendar connection status"""
-        try:
-            is_available = calendar_service.check_availability()
-            is_authenticated = 'google_calendar_credentials' in session
-
-            if not is_available:
-                error_msg = calendar_service.get_configuration_error()
-                logger.error(f"Calendar status check failed: {error_msg}")
-                return jsonify({
-                    "status": "error",
-                    "available": False,
-                    "message": error_msg,
-                    "authenticated": False
-                })
-
-            return jsonify({
-                "status": "success",
-                "available": True,
-                "authenticated": is_authenticated
-            })
-        except Exception as e:
-            error_msg = f"Error checking calendar status: {str(e)}"
-            logger.error(error_msg, exc_info=True)
+        calendar_service = get_calendar_service()
+        # Polled on every page load; a missing configuration is logged once
+        # when CalendarService is created, not here.
+        if not calendar_service.check_availability():
             return jsonify({
                 "status": "error",
-                "message": error_msg,
                 "available": False,
+                "message": calendar_service.get_configuration_error(),
                 "authenticated": False
-            }), 500
+            })
+
+        # The page adds the calendar cookie flag to this URL, so a browser-cached
+        # answer is never reused across connecting the calendar
+        return jsonify({
+            "status": "success",
+            "available": True,
+            "authenticated": 'google_calendar_credentials' in session
+        }), 200, {"Cache-Control": "private, max-age=30"}
 
     @app.route("/api/calendar/auth")
     @login_required
     def calendar_auth():
         """Initiate Google Calendar OAuth flow"""
-        try:
-            if not calendar_service.check_availability():
-                error_msg = calendar_service.get_configuration_error()
-                logger.error(f"Calendar auth failed: {error_msg}")
-                return jsonify({
-                    "status": "error",
-                    "message": error_msg
-                }), 503
-
-            authorization_url, state = calendar_service.get_authorization_url()
-            session['calendar_oauth_state'] = state
-            logger.debug(f"Redirecting to authorization URL: {authorization_url}")
-            return redirect(authorization_url)
-        except Exception as e:
-            error_msg = f"Error in calendar auth: {str(e)}"
-            logger.error(error_msg, exc_info=True)
-            return jsonify({"status": "error", "message": error_msg}), 500
+        calendar_service = get_calendar_service()
+        if not calendar_service.check_availability():
+            error_msg = calendar_service.get_configuration_error()
+            logger.error("Calendar auth failed: %s", error_msg)
+            raise APIError(error_msg, 503)
+
+        authorization_url, state = calendar_service.get_authorization_url()
+        session['calendar_oauth_state'] = state
+        logger.debug("Redirecting to authorization URL: %s", authorization_url)
+        return redirect(authorization_url)
 
     @app.route("/api/chat/select", methods=["POST"])
     @login_required
     def select_plan():
         """Handle plan selection and save to database."""
-        try:
-            logger.debug("Received plan selection request")
-            data = request.get_json()
-            if not data:
-                return jsonify({"status": "error", "message": "No data provided"}), 400
-
-            # Validate required fields
-            if not all(key in data for key in ['start_date', 'content', 'original_query']):
-                return jsonify({
-                    "status": "error",
-                    "message": "Missing required data. Please provide start_date, content, and original_query."
-                }), 400
-
-            try:
-                # Save to Airtable with basic required fields
-                saved_plan = airtable_service.save_user_itinerary(
-                    user_id=str(current_user.id),
-                    original_query=data['original_query'],
-                    selected_itinerary=data['content'],
-                    start_date=data['start_date']
-                )
-
-                logger.debug(f"Successfully saved plan: {saved_plan['id']}")
-                return jsonify({
-                    "status": "success",
-                    "plan_id": saved_plan['id']
-                })
-
-            except Exception as e:
-                logger.error(f"Airtable save error: {str(e)}")
-                # Return a more user-friendly error message
-                error_msg = "Unable to save your travel plan. Please try again or contact support if the issue persists."
-                return jsonify({
-                    "status": "error",
-                    "message": error_msg
-                }), 500
+        logger.debug("Received plan selection request")
+        # Missing fields and malformed dates are rejected during decoding
+        plan = _decode_body(
+            SelectPlanRequest,
+            "Missing required data. Please provide start_date, content, and original_query."
+        )
 
+        try:
+            # Save to Airtable with basic required fields
+            saved_plan = get_airtable_service().save_user_itinerary(
+                user_id=str(current_user.id),
+                original_query=plan.original_query,
+                selected_itinerary=plan.content,
+                start_date=plan.start_date.isoformat()
+            )
         except Exception as e:
-            logger.error(f"Error in select_plan: {str(e)}", exc_info=True)
-            return jsonify({
-                "status": "error",
-                "message": "An unexpected error occurred while saving the plan"
-            }), 500
+            logger.error("Airtable save error: %s", e)
+            # Return a more user-friendly error message
+            raise APIError(
+                "Unable to save your travel plan. Please try again or contact support if the issue persists.",
+                500
+            ) from e
+
+        logger.debug("Successfully saved plan: %s", saved_plan['id'])
+        return jsonify({
+            "status": "success",
+            "plan_id": saved_plan['id']
+        })
 
     @app.route("/api/calendar/add", methods=["POST"])
     @login_required
     def add_to_calendar():
         """Add selected plan to Google Calendar."""
-        try:
-            if not calendar_service.check_availability():
-                return jsonify({
-                    "status": "error",
-                    "message": "Calendar service is not available"
-                }), 503
-
-            if 'google_calendar_credentials' not in session:
-                return jsonify({
-                    "status": "error",
-                    "message": "Please connect your Google Calendar first"
-                }), 401
-
-            data = request.get_json()
-            if not data or 'content' not in data or 'start_date' not in data:
-                return jsonify({
-                    "status": "error",
-                    "message": "Missing required data"
-                }), 400
-
-            try:
-                # Create calendar events directly from the provided content
-                events = calendar_service.create_events_from_plan(
-                    itinerary_content=data['content'],
-                    start_date=data['start_date'],
-                    user_email=current_user.email
-                )
-
-                if not events:
-                    return jsonify({
-                        "status": "error",
-                        "message": "No events were created. Please check the itinerary format."
-                    }), 400
-
-                return jsonify({
-                    "status": "success",
-                    "message": f"Successfully added {len(events)} events to your calendar",
-                    "events": events
-                })
-
-            except Exception as e:
-                logger.error(f"Error creating calendar events: {str(e)}")
-                return jsonify({
-                    "status": "error",
-                    "message": str(e)
-                }), 500
+        calendar_service = get_calendar_service()
+        if not calendar_service.check_availability():
+            raise APIError("Calendar service is not available", 503)
 
-        except Exception as e:
-            logger.error(f"Error adding to calendar: {e}", exc_info=True)
-            return jsonify({
-                "status": "error",
-                "message": "An unexpected error occurred. Please try again."
-            }), 500
+        if 'google_calendar_credentials' not in session:
+            raise APIError("Please connect your Google Calendar first", 401)
+
+        plan = _decode_body(CalendarAddRequest, "Missing required data")
+
+        # Create calendar events directly from the provided content
+        events = calendar_service.create_events_from_plan(
+            itinerary_content=plan.content,
+            start_date=plan.start_date.isoformat(),
+            user_email=current_user.email
+        )
+
+        if not events:
+            raise APIError("No events were created. Please check the itinerary format.")
+
+        return jsonify({
+            "status": "success",
+            "message": f"Successfully added {len(events)} events to your calendar",
+            "events": events
+        })
 
     @app.route("/api/plans", methods=["GET"])
     @login_required
     def get_user_plans():
         """Get all travel plans for the current user."""
-        try:
-            plans = airtable_service.get_user_itineraries(str(current_user.id))
-            return jsonify({
-                "status": "success",
-                "plans": plans
-            })
-        except Exception as e:
-            logger.error(f"Error fetching user plans: {e}", exc_info=True)
-            return jsonify({"status": "error", "message": str(e)}), 500
+        plans = get_airtable_service().get_user_itineraries(str(current_user.id))
+        return jsonify({
+            "status": "success",
+            "plans": plans
+        })
 
     @app.route("/api/preferences", methods=["POST"])
     @login_required
     def update_preferences():
         """Save user preferences in Airtable."""
-        try:
-            data = request.get_json()
-            user_id = str(current_user.id)
-            prefs = data.get("preferences", {})
+        prefs = _decode_body(PreferencesRequest).preferences
+        user_id = str(current_user.id)
 
-            airtable_service.save_user_preferences(user_id, prefs)
-            return jsonify({"status": "success"})
-        except Exception as e:
-            logger.error(f"Error updating preferences: {e}", exc_info=True)
-            return jsonify({"status": "error", "message": str(e)}), 500
+        get_airtable_service().save_user_preferences(user_id, prefs)
+        preference_cache.invalidate(user_id)
+        return jsonify({"status": "success"})
 
     @app.route("/preferences")
     @login_required
     def preferences():
         """Show user preferences management page"""
-        try:
-            user_id = str(current_user.id)
-            user_prefs = airtable_service.get_user_preferences(user_id) or {}
-            return render_template("preferences.html", preferences=user_prefs)
-        except Exception as e:
-            logger.error(f"Error fetching preferences: {e}", exc_info=True)
-            return jsonify({"status": "error", "message": str(e)}), 500
+        user_prefs = get_cached_preferences(str(current_user.id)) or {}
+        return render_template("preferences.html", preferences=user_prefs)
 
     @app.route("/")
     def index():
         """Redirect to login if not authenticated, otherwise show main page"""
         if not current_user.is_authenticated:
             return redirect(url_for('auth.login'))
-        return render_template("index.html")
+        body, etag = _index_page()
+        response = Response(body, mimetype="text/html")
+        response.set_etag(etag)
+        # Browsers revalidate on every visit, so the login check above still
+        # runs; an unchanged page costs a 304 instead of the full HTML.
+        response.headers["Cache-Control"] = "private, no-cache"
+        return response.make_conditional(request)
+
+    @app.cli.command("import-preferences")
+    @click.argument("path", type=click.Path(exists=True, dir_okay=False))
+    def import_preferences(path):
+        """Bulk-save preferences from a JSON list of {user_id, preferences}."""
+        with open(path, "rb") as f:
+            entries = orjson.loads(f.read())
+        preferences_by_user = {str(entry["user_id"]): entry.get("preferences", {}) for entry in entries}
+        result = get_airtable_service().batch_save_user_preferences(preferences_by_user)
+        for user_id in preferences_by_user:
+            preference_cache.invalidate(user_id)
+        click.echo(
+            f"Created {len(result['createdRecords'])}, "
+            f"updated {len(result['updatedRecords'])} preference records"
+        )
 
     logger.debug("All routes registered successfully")
     return app
\ No newline at end of file
@@ -0,0 +1,20 @@
+from datetime import date
+from typing import Any
+import msgspec
+
+# Request bodies, decoded straight from bytes by msgspec in one pass
+
+class ChatRequest(msgspec.Struct):
+    message: str = ""
+
+class PreferencesRequest(msgspec.Struct):
+    preferences: dict[str, Any] = {}
+
+class SelectPlanRequest(msgspec.Struct):
+    start_date: date
+    content: str
+    original_query: str
+
+class CalendarAddRequest(msgspec.Struct):
+    content: str
+    start_date: date
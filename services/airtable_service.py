@@ -1,9 +1,29 @@
 import os
 import logging
 import re
+import threading
 from typing import Dict, Optional, List
-from datetime import datetime, timedelta
-from pyairtable import Table
+from concurrent.futures import ThreadPoolExecutor
+from datetime import date, datetime, timedelta
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+from pyairtable import Api
+
+# Runs Airtable housekeeping that callers don't need to wait for
+_background_executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="airtable")
+
+# Replaying these can't create a second record; POST (record creation) is not
+# among them, so a gateway error after Airtable saved the record isn't resent
+IDEMPOTENT_METHODS = frozenset({"GET", "PATCH", "DELETE"})
+
+class _AirtableRetry(Retry):
+    """Retry 429s on any method, but 5xx and read errors only on idempotent ones"""
+
+    def is_retry(self, method, status_code, has_retry_after=False):
+        # A rate-limited request was rejected before Airtable acted on it
+        if status_code == 429:
+            return True
+        return super().is_retry(method, status_code, has_retry_after)
 
 class AirtableService:
     def __init__(self):
@@ -11,7 +31,7 @@ class AirtableService:
         self.base_id = os.environ.get("AIRTABLE_BASE_ID")
 
         logging.info("Initializing Airtable Service...")
-        logging.info(f"Using base ID: {self.base_id}")
+        logging.info("Using base ID: %s", self.base_id)
 
         if not self.access_token or not self.base_id:
             logging.error("Missing Airtable credentials")
@@ -49,44 +69,71 @@ class AirtableService:
         self._initialize_tables()
 
     def _initialize_tables(self):
-        """Initialize and verify tables and their required fields"""
+        """Initialize tables and verify their required fields in the background"""
         try:
-            logging.info(f"Attempting to connect to tables in base {self.base_id}")
-            self.preferences_table = Table(self.access_token, self.base_id, self.USER_PREFERENCES)
-            self.itineraries_table = Table(self.access_token, self.base_id, self.ITINERARIES)
+            logging.info("Attempting to connect to tables in base %s", self.base_id)
+            # One Api means one pooled requests session for both tables. Retry
+            # Airtable's 429s and transient gateway errors with backoff.
+            retry = _AirtableRetry(
+                total=4,
+                backoff_factor=0.2,
+                status_forcelist=(429, 502, 503, 504),
+                allowed_methods=IDEMPOTENT_METHODS
+            )
+            self.api = Api(self.access_token, timeout=(5, 30), retry_strategy=retry)
+            # Size the pool for concurrent gevent requests, not requests' default of 10
+            self.api.session.mount("https://", HTTPAdapter(pool_maxsize=50, max_retries=retry))
+            self.preferences_table = self.api.table(self.base_id, self.USER_PREFERENCES)
+            self.itineraries_table = self.api.table(self.base_id, self.ITINERARIES)
+        except Exception as e:
+            logging.error("Airtable connection error: %s", e)
+            raise ValueError(f"Failed to connect to Airtable: {str(e)}")
 
-            # Verify and update preferences table fields
-            try:
-                prefs_records = self.preferences_table.all(max_records=1)
-                if prefs_records:
-                    existing_pref_fields = list(prefs_records[0]['fields'].keys())
-                    logging.info(f"Fields in {self.USER_PREFERENCES}: {existing_pref_fields}")
-                    # Note: We can't create fields via API, log missing fields
-                    missing_pref_fields = set(self.REQUIRED_PREFERENCE_FIELDS) - set(existing_pref_fields)
-                    if missing_pref_fields:
-                        logging.warning(f"Missing fields in {self.USER_PREFERENCES}: {missing_pref_fields}")
-            except Exception as e:
-                logging.warning(f"Could not read from {self.USER_PREFERENCES} table: {str(e)}")
-
-            # Verify and update itineraries table fields
-            try:
-                itn_records = self.itineraries_table.all(max_records=1)
-                if itn_records:
-                    existing_itn_fields = list(itn_records[0]['fields'].keys())
-                    logging.info(f"Fields in {self.ITINERARIES}: {existing_itn_fields}")
-                    # Note: We can't create fields via API, log missing fields
-                    missing_itn_fields = set(self.REQUIRED_ITINERARY_FIELDS) - set(existing_itn_fields)
-                    if missing_itn_fields:
-                        logging.warning(f"Missing fields in {self.ITINERARIES}: {missing_itn_fields}")
-            except Exception as e:
-                logging.error(f"Could not read from {self.ITINERARIES} table: {str(e)}")
-                raise ValueError(
-                    f"Please ensure '{self.ITINERARIES}' table exists with fields: {', '.join(self.REQUIRED_ITINERARY_FIELDS)}"
-                )
+        # Field verification only logs, so keep its round-trips off the
+        # request that first needs the service.
+        _background_executor.submit(self._verify_tables)
 
+    def _verify_tables(self):
+        """Log any required fields missing from the Airtable tables"""
+        # Verify preferences table fields
+        try:
+            prefs_records = self.preferences_table.all(max_records=1)
+            if prefs_records:
+                existing_pref_fields = list(prefs_records[0]['fields'].keys())
+                logging.info("Fields in %s: %s", self.USER_PREFERENCES, existing_pref_fields)
+                # Note: We can't create fields via API, log missing fields
+                missing_pref_fields = set(self.REQUIRED_PREFERENCE_FIELDS) - set(existing_pref_fields)
+                if missing_pref_fields:
+                    logging.warning("Missing fields in %s: %s", self.USER_PREFERENCES, missing_pref_fields)
         except Exception as e:
-            logging.error(f"Airtable connection error: {str(e)}")
-            raise ValueError(f"Failed to connect to Airtable: {str(e)}")
+            logging.warning("Could not read from %s table: %s", self.USER_PREFERENCES, e)
+
+        # Verify itineraries table fields
+        try:
+            itn_records = self.itineraries_table.all(max_records=1)
+            if itn_records:
+                existing_itn_fields = list(itn_records[0]['fields'].keys())
+                logging.info("Fields in %s: %s", self.ITINERARIES, existing_itn_fields)
+                # Note: We can't create fields via API, log missing fields
+                missing_itn_fields = set(self.REQUIRED_ITINERARY_FIELDS) - set(existing_itn_fields)
+                if missing_itn_fields:
+                    logging.warning("Missing fields in %s: %s", self.ITINERARIES, missing_itn_fields)
+        except Exception as e:
+            logging.error(
+                "Could not read from %s table: %s. "
+                "Please ensure '%s' table exists with fields: %s",
+                self.ITINERARIES, e, self.ITINERARIES,
+                ', '.join(self.REQUIRED_ITINERARY_FIELDS)
+            )
+
+    def _verify_preference_fields(self, fields: Dict) -> Dict:
+        """Verify and clean fields before saving to preferences table"""
+        verified_fields = {}
+        for field in self.REQUIRED_PREFERENCE_FIELDS:
+            # Writing None would clear the stored value; leave it untouched
+            if fields.get(field) is not None:
+                verified_fields[field] = fields[field]
+        return verified_fields
 
     def _verify_itinerary_fields(self, fields: Dict) -> Dict:
         """Verify and clean fields before saving to itinerary table"""
@@ -123,15 +170,15 @@ class AirtableService:
                 if test_record and 'Content' in test_record[0]['fields']:
                     itinerary_fields['Content'] = selected_itinerary
             except Exception as field_error:
-                logging.warning(f"Some fields could not be added: {str(field_error)}")
+                logging.warning("Some fields could not be added: %s", field_error)
 
             new_record = self.itineraries_table.create(itinerary_fields)
-            logging.debug(f"Created itinerary record with ID {new_record['id']}")
+            logging.debug("Created itinerary record with ID %s", new_record['id'])
 
             return new_record
 
         except Exception as e:
-            logging.error(f"Error saving user itinerary: {str(e)}")
+            logging.error("Error saving user itinerary: %s", e)
             raise ValueError(f"Failed to save itinerary: {str(e)}")
 
     def get_user_itinerary(self, user_id: str, plan_id: str) -> Optional[Dict]:
@@ -141,16 +188,17 @@ class AirtableService:
             records = self.itineraries_table.all(formula=formula)
             if records:
                 record = records[0]
+                fields = record['fields']
                 return {
                     'id': record['id'],
-                    'content': record['fields'].get('Content', ''),
-                    'start_date': record['fields'].get('Start Date', ''),
-                    'end_date': record['fields'].get('End Date', ''),
-                    'destination': record['fields'].get('Destination', '')
+                    'content': fields.get('Content', ''),
+                    'start_date': fields.get('Start Date', ''),
+                    'end_date': fields.get('End Date', ''),
+                    'destination': fields.get('Destination', '')
                 }
             return None
         except Exception as e:
-            logging.error(f"Error retrieving itinerary: {str(e)}")
+            logging.error("Error retrieving itinerary: %s", e)
             raise ValueError(f"Failed to retrieve itinerary: {str(e)}")
 
     def get_user_itineraries(self, user_id: str) -> List[Dict]:
@@ -158,21 +206,25 @@ class AirtableService:
         try:
             formula = f"{{User ID}} = '{user_id}'"
             records = self.itineraries_table.all(formula=formula)
-            return [{
-                'id': record['id'],
-                'destination': record['fields'].get('Destination', ''),
-                'start_date': record['fields'].get('Start Date', ''),
-                'end_date': record['fields'].get('End Date', ''),
-                'status': record['fields'].get('Status', 'Active')
-            } for record in records]
+            itineraries = []
+            for record in records:
+                fields = record['fields']
+                itineraries.append({
+                    'id': record['id'],
+                    'destination': fields.get('Destination', ''),
+                    'start_date': fields.get('Start Date', ''),
+                    'end_date': fields.get('End Date', ''),
+                    'status': fields.get('Status', 'Active')
+                })
+            return itineraries
         except Exception as e:
-            logging.error(f"Error retrieving itineraries: {str(e)}")
+            logging.error("Error retrieving itineraries: %s", e)
             raise ValueError(f"Failed to retrieve itineraries: {str(e)}")
 
     def calculate_end_date(self, itinerary_content: str, start_date: str) -> str:
         """Calculate the end date based on the itinerary content"""
         try:
-            start_dt = datetime.strptime(start_date, '%Y-%m-%d')
+            start_dt = date.fromisoformat(start_date)
             day_pattern = r'Day\s+(\d+)'
             days = re.findall(day_pattern, itinerary_content, re.IGNORECASE)
             if days:
@@ -182,8 +234,8 @@ class AirtableService:
                 end_dt = start_dt + timedelta(days=6)
             return end_dt.strftime('%Y-%m-%d')
         except Exception as e:
-            logging.error(f"Error calculating end date: {str(e)}")
-            return (datetime.strptime(start_date, '%Y-%m-%d') + timedelta(days=6)).strftime('%Y-%m-%d')
+            logging.error("Error calculating end date: %s", e)
+            return (date.fromisoformat(start_date) + timedelta(days=6)).isoformat()
 
     def extract_destination_from_query(self, query: str) -> str:
         """Extract the destination from the user's query"""
@@ -203,7 +255,7 @@ class AirtableService:
                     return destination.title()
             return "Unknown Destination"
         except Exception as e:
-            logging.error(f"Error extracting destination: {str(e)}")
+            logging.error("Error extracting destination: %s", e)
             return "Unknown Destination"
 
     def get_user_preferences(self, user_id: str) -> Optional[Dict]:
@@ -219,7 +271,7 @@ class AirtableService:
                 }
             return None
         except Exception as e:
-            logging.error(f"Error retrieving user preferences: {str(e)}")
+            logging.error("Error retrieving user preferences: %s", e)
             raise ValueError(f"Failed to retrieve preferences: {str(e)}")
 
     def save_user_preferences(self, user_id: str, preferences: Dict) -> Dict:
@@ -228,7 +280,7 @@ class AirtableService:
             formula = f"{{User ID}} = '{user_id}'"
             existing_records = self.preferences_table.all(formula=formula)
 
-            fields = self._verify_itinerary_fields({
+            fields = self._verify_preference_fields({
                 'User ID': user_id,
                 'Budget Preference': preferences.get('budget'),
                 'Travel Style': preferences.get('travel_style'),
@@ -242,7 +294,27 @@ class AirtableService:
                 return self.preferences_table.create(fields)
 
         except Exception as e:
-            logging.error(f"Error saving user preferences: {str(e)}")
+            logging.error("Error saving user preferences: %s", e)
+            raise ValueError(f"Failed to save preferences: {str(e)}")
+
+    def batch_save_user_preferences(self, preferences_by_user: Dict[str, Dict]) -> Dict:
+        """Save or update preferences for many users, ten records per request"""
+        try:
+            today = datetime.now().strftime('%Y-%m-%d')
+            records = [
+                {'fields': self._verify_preference_fields({
+                    'User ID': user_id,
+                    'Budget Preference': preferences.get('budget'),
+                    'Travel Style': preferences.get('travel_style'),
+                    'Last Updated Date': today
+                })}
+                for user_id, preferences in preferences_by_user.items()
+            ]
+            # pyairtable splits this into Airtable's 10-record batches and
+            # matches existing rows on User ID, so there is no lookup first
+            return self.preferences_table.batch_upsert(records, key_fields=['User ID'])
+        except Exception as e:
+            logging.error("Error batch saving user preferences: %s", e)
             raise ValueError(f"Failed to save preferences: {str(e)}")
 
     def extract_dates_from_itinerary(self, content: str) -> tuple:
@@ -256,7 +328,7 @@ class AirtableService:
                 parsed = []
                 for d in dates:
                     if '-' in d:
-                        parsed.append(datetime.strptime(d, '%Y-%m-%d'))
+                        parsed.append(datetime.fromisoformat(d))
                     else:
                         parsed.append(datetime.strptime(d, '%m/%d/%Y'))
                 start_date = min(parsed).strftime('%m/%d/%Y')
@@ -277,8 +349,21 @@ class AirtableService:
             return start_date, end_date
 
         except Exception as e:
-            logging.error(f"Error extracting dates from itinerary: {str(e)}")
+            logging.error("Error extracting dates from itinerary: %s", e)
             # fallback: current date + 7 days
             sd = datetime.now().strftime('%m/%d/%Y')
             ed = (datetime.now() + timedelta(days=7)).strftime('%m/%d/%Y')
-            return (sd, ed)
\ No newline at end of file
+            return (sd, ed)
+
+_shared_service: Optional[AirtableService] = None
+_shared_lock = threading.Lock()
+
+def get_airtable_service() -> AirtableService:
+    """Return the process-wide AirtableService, connecting to Airtable on first use"""
+    global _shared_service
+    if _shared_service is None:
+        # The gunicorn warm-up thread and a worker's first request can race here
+        with _shared_lock:
+            if _shared_service is None:
+                _shared_service = AirtableService()
+    return _shared_service
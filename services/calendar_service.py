@@ -1,36 +1,66 @@
 import os
+import functools
 import logging
 import re
+import secrets
 from datetime import datetime, timedelta
-from google.oauth2.credentials import Credentials
-from google_auth_oauthlib.flow import Flow
-from googleapiclient.discovery import build
 from flask import session
+from services import http_pool
 
-logging.basicConfig(level=logging.DEBUG)
 logger = logging.getLogger(__name__)
 
 class CalendarService:
+    # Tags calendar OAuth state so the shared callback can tell it from login
+    STATE_PREFIX = 'cal:'
+
     def __init__(self):
         self.replit_domain = "ai-travel-buddy-bboyswagat.replit.app"
+        # Calendar authorization shares the auth blueprint's callback
+        self.redirect_uri = os.environ.get(
+            "OAUTH_REDIRECT_URI", f"https://{self.replit_domain}/auth/google_callback"
+        )
         self.client_id = os.environ.get('GOOGLE_CALENDAR_CLIENT_ID', '').strip()
         self.client_secret = os.environ.get('GOOGLE_CALENDAR_CLIENT_SECRET', '').strip()
         self.SCOPES = ['https://www.googleapis.com/auth/calendar.events']
         self.is_available = bool(self.client_id and self.client_secret)
+        # Static for the life of the process; built once for both OAuth steps
+        self.client_config = {
+            "web": {
+                "client_id": self.client_id,
+                "client_secret": self.client_secret,
+                "auth_uri": "https://accounts.google.com/o/oauth2/auth",
+                "token_uri": "https://oauth2.googleapis.com/token",
+                "redirect_uris": [self.redirect_uri]
+            }
+        }
+        if not self.is_available:
+            logger.warning("Google Calendar integration disabled: %s", self.get_configuration_error())
 
     def create_events_from_plan(self, itinerary_content: str, start_date: str, user_email: str) -> list:
         """Create calendar events from an itinerary"""
         try:
-            logger.debug(f"Starting calendar event creation for user: {user_email}")
-            logger.debug(f"Raw itinerary content: {itinerary_content}")
+            logger.debug("Starting calendar event creation for user: %s", user_email)
+            if logger.isEnabledFor(logging.DEBUG):
+                logger.debug("Raw itinerary content: %r", itinerary_content[:2000])
 
             if 'google_calendar_credentials' not in session:
                 raise ValueError("Google Calendar credentials not found in session")
 
-            creds = Credentials.from_authorized_user_info(session['google_calendar_credentials'], self.SCOPES)
+            # Imported lazily so app startup doesn't load the API client stack
+            from google.oauth2.credentials import Credentials
+            from googleapiclient.discovery import build
+
+            # The cookie only holds the user's tokens; the client credentials
+            # come from our own configuration.
+            creds_info = {
+                **session['google_calendar_credentials'],
+                'client_id': self.client_id,
+                'client_secret': self.client_secret
+            }
+            creds = Credentials.from_authorized_user_info(creds_info, self.SCOPES)
             service = build('calendar', 'v3', credentials=creds)
 
-            start_dt = datetime.strptime(start_date, '%Y-%m-%d')
+            start_dt = datetime.fromisoformat(start_date)
             events = []
 
             # Extract days and activities using pattern matching
@@ -50,7 +80,7 @@ class CalendarService:
                 day_match = re.search(day_pattern, line)
                 if day_match:
                     current_day = int(day_match.group(1))
-                    logger.debug(f"Processing Day {current_day}")
+                    logger.debug("Processing Day %s", current_day)
                     continue
 
                 # Check for activity
@@ -89,7 +119,7 @@ class CalendarService:
                     time_str = f"{hour:02d}:{minute:02d}"
                     event_title = f"Day {current_day}: {time_str}: {activity_desc}"
 
-                    logger.debug(f"Creating event: {event_title}")
+                    logger.debug("Creating event: %s", event_title)
 
                     event = {
                         'summary': event_title,
@@ -126,10 +156,10 @@ class CalendarService:
                             'start': created_event['start']['dateTime'],
                             'end': created_event['end']['dateTime']
                         })
-                        logger.debug(f"Successfully created event: {event_title}")
+                        logger.debug("Successfully created event: %s", event_title)
 
                     except Exception as e:
-                        logger.error(f"Failed to create event {event_title}: {str(e)}")
+                        logger.error("Failed to create event %s: %s", event_title, e)
                         continue
 
             if not events:
@@ -138,7 +168,7 @@ class CalendarService:
             return events
 
         except Exception as e:
-            logger.error(f"Error in create_events_from_plan: {str(e)}")
+            logger.error("Error in create_events_from_plan: %s", e)
             raise ValueError(str(e))
 
     def check_availability(self):
@@ -148,23 +178,16 @@ class CalendarService:
         if not self.check_availability():
             raise ValueError("Calendar service is not configured")
 
-        redirect_uri = f"https://{self.replit_domain}/auth/google_callback"
-        client_config = {
-            "web": {
-                "client_id": self.client_id,
-                "client_secret": self.client_secret,
-                "auth_uri": "https://accounts.google.com/o/oauth2/auth",
-                "token_uri": "https://oauth2.googleapis.com/token",
-                "redirect_uris": [redirect_uri]
-            }
-        }
+        # Imported lazily so app startup doesn't load the OAuth stack
+        from google_auth_oauthlib.flow import Flow
 
-        flow = Flow.from_client_config(client_config, scopes=self.SCOPES)
-        flow.redirect_uri = redirect_uri
+        flow = Flow.from_client_config(self.client_config, scopes=self.SCOPES)
+        flow.redirect_uri = self.redirect_uri
         authorization_url, state = flow.authorization_url(
             access_type='offline',
             include_granted_scopes='true',
-            prompt='consent'
+            prompt='consent',
+            state=self.STATE_PREFIX + secrets.token_urlsafe(16)
         )
 
         return authorization_url, state
@@ -173,28 +196,21 @@ class CalendarService:
         if not self.check_availability():
             raise ValueError("Calendar service is not configured")
 
-        redirect_uri = f"https://{self.replit_domain}/auth/google_callback"
-        client_config = {
-            "web": {
-                "client_id": self.client_id,
-                "client_secret": self.client_secret,
-                "auth_uri": "https://accounts.google.com/o/oauth2/auth",
-                "token_uri": "https://oauth2.googleapis.com/token",
-                "redirect_uris": [redirect_uri]
-            }
-        }
-
         try:
+            from google_auth_oauthlib.flow import Flow
+
             flow = Flow.from_client_config(
-                client_config,
+                self.client_config,
                 scopes=self.SCOPES,
                 state=session_state
             )
-            flow.redirect_uri = redirect_uri
+            flow.redirect_uri = self.redirect_uri
 
             if request_url.startswith('http://'):
                 request_url = 'https://' + request_url[7:]
 
+            # Exchange the code over the shared keep-alive pool
+            flow.oauth2session.mount("https://", http_pool.https_adapter)
             flow.fetch_token(authorization_response=request_url)
             creds = flow.credentials
 
@@ -202,12 +218,10 @@ class CalendarService:
                 'token': creds.token,
                 'refresh_token': creds.refresh_token,
                 'token_uri': creds.token_uri,
-                'client_id': creds.client_id,
-                'client_secret': creds.client_secret,
                 'scopes': creds.scopes
             }
         except Exception as e:
-            logger.error(f"Error in OAuth callback: {str(e)}")
+            logger.error("Error in OAuth callback: %s", e)
             raise
 
     def get_configuration_error(self):
@@ -215,4 +229,9 @@ class CalendarService:
             return "Google Calendar Client ID is missing"
         if not self.client_secret:
             return "Google Calendar Client Secret is missing"
-        return "Unknown configuration error"
\ No newline at end of file
+        return "Unknown configuration error"
+
+@functools.lru_cache(maxsize=1)
+def get_calendar_service() -> CalendarService:
+    """Return the process-wide CalendarService, built on first use rather than at import"""
+    return CalendarService()
@@ -0,0 +1,19 @@
+"""Connection pool shared by every requests-based call to Google"""
+import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+
+# One adapter owns one urllib3 pool, so mounting it on several sessions (our
+# own and each OAuth Flow's oauth2session) lets them all reuse the same
+# keep-alive TLS connections instead of handshaking per login or callback.
+https_adapter = HTTPAdapter(
+    pool_connections=8,
+    pool_maxsize=32,
+    max_retries=Retry(total=2, backoff_factor=0.2, status_forcelist=[502, 503, 504])
+)
+
+def new_session() -> requests.Session:
+    """Return a requests session whose HTTPS traffic goes through the shared pool"""
+    http = requests.Session()
+    http.mount("https://", https_adapter)
+    return http
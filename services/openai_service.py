@@ -3,35 +3,42 @@ import time
 import random
 import logging
 import json
-from openai import OpenAI, RateLimitError, APIError, APIConnectionError
+import httpx
+from openai import OpenAI, DefaultHttpxClient, RateLimitError, APIError, APIConnectionError, APITimeoutError, InternalServerError
 from services.ai_agents import AgentRegistry, AgentRole
 
-# Configure logging
-logging.basicConfig(level=logging.DEBUG)
 logger = logging.getLogger(__name__)
 
-# Initialize OpenAI client with retry mechanism
-client = OpenAI(api_key=os.environ.get("OPENAI_API_KEY"))
+# Initialize OpenAI client with retry mechanism. One module-level client
+# keeps a pool of TLS connections to api.openai.com alive across requests.
+# The SDK's own retries are off: generate_travel_plan and
+# make_api_call_with_retry back off on rate limits, timeouts, connection
+# errors and 5xx themselves, and stacking both would multiply requests.
+client = OpenAI(
+    api_key=os.environ.get("OPENAI_API_KEY"),
+    max_retries=0,
+    http_client=DefaultHttpxClient(
+        limits=httpx.Limits(max_connections=50, max_keepalive_connections=20, keepalive_expiry=60),
+        timeout=httpx.Timeout(60.0, connect=5.0)
+    )
+)
 
 # Configuration
+DEFAULT_MODEL = "gpt-3.5-turbo"
+MAX_TOKENS_ANALYSIS = 1000
+
+# Retry configuration
 MAX_RETRIES = 3
 BACKOFF_FACTOR = 2
-DEFAULT_MODEL = "gpt-3.5-turbo"
+BASE_DELAY = 1  # Initial delay in seconds
+MAX_DELAY = 32  # Maximum delay in seconds
+JITTER = 0.1  # Random jitter factor
+# A timed-out plan attempt has already used PLAN_TIMEOUT seconds, so allow
+# only one more: two attempts plus backoff stay under gunicorn's 120s timeout
+PLAN_TIMEOUT = 50.0
+MAX_TIMEOUT_ATTEMPTS = 2
 
-def generate_travel_plan(message, user_preferences=None):
-    """Generate travel recommendations using OpenAI's API"""
-    try:
-        # Format preferences if they exist
-        preferences_text = ""
-        if user_preferences:
-            preferences_text = "User preferences:\n" + "\n".join(
-                f"- {k}: {v}" for k, v in user_preferences.items() if v
-            )
-
-        messages = [
-            {
-                "role": "system",
-                "content": """You are a travel planning assistant. Create TWO distinct travel plans.
+PLAN_SYSTEM_PROMPT = """You are a travel planning assistant. Create TWO distinct travel plans.
                 Each plan should follow this format:
 
                 Option 1: [Title]
@@ -47,42 +54,66 @@ def generate_travel_plan(message, user_preferences=None):
                 Option 2: [Different Title]
                 [Different description]
                 [Same format as Option 1]"""
-            },
-            {
-                "role": "user",
-                "content": f"{preferences_text}\n\nPlease plan this trip: {message}"
-            }
+
+def build_plan_messages(message, user_preferences=None):
+    """Build the chat messages for a travel plan request"""
+    # Format preferences if they exist
+    preferences_text = ""
+    if user_preferences:
+        preferences_text = "User preferences:\n" + "\n".join(
+            f"- {k}: {v}" for k, v in user_preferences.items() if v
+        )
+
+    return [
+        {
+            "role": "system",
+            "content": PLAN_SYSTEM_PROMPT
+        },
+        {
+            "role": "user",
+            "content": f"{preferences_text}\n\nPlease plan this trip: {message}"
+        }
+    ]
+
+def split_travel_plans(content):
+    """Split a completion into the two plan alternatives returned to the client"""
+    plans = content.split('---')
+
+    # Ensure we have two plans
+    if len(plans) != 2:
+        if "Option 2:" in content:
+            plans = content.split("Option 2:")
+            plans[1] = "Option 2:" + plans[1]
+        else:
+            mid = len(content) // 2
+            plans = [content[:mid], content[mid:]]
+
+    return {
+        "status": "success",
+        "alternatives": [
+            {"id": "plan1", "content": plans[0].strip(), "type": "itinerary"},
+            {"id": "plan2", "content": plans[1].strip(), "type": "itinerary"}
         ]
+    }
 
+def generate_travel_plan(message, user_preferences=None):
+    """Generate travel recommendations using OpenAI's API"""
+    try:
+        messages = build_plan_messages(message, user_preferences)
+
+        timeouts = 0
         for attempt in range(MAX_RETRIES):
             try:
-                logger.debug(f"Attempt {attempt + 1} to generate travel plan")
+                logger.debug("Attempt %s to generate travel plan", attempt + 1)
                 response = client.chat.completions.create(
                     model=DEFAULT_MODEL,
                     messages=messages,
                     temperature=0.7,
-                    max_tokens=2000
+                    max_tokens=2000,
+                    timeout=PLAN_TIMEOUT
                 )
 
-                content = response.choices[0].message.content
-                plans = content.split('---')
-
-                # Ensure we have two plans
-                if len(plans) != 2:
-                    if "Option 2:" in content:
-                        plans = content.split("Option 2:")
-                        plans[1] = "Option 2:" + plans[1]
-                    else:
-                        mid = len(content) // 2
-                        plans = [content[:mid], content[mid:]]
-
-                result = {
-                    "status": "success",
-                    "alternatives": [
-                        {"id": "plan1", "content": plans[0].strip(), "type": "itinerary"},
-                        {"id": "plan2", "content": plans[1].strip(), "type": "itinerary"}
-                    ]
-                }
+                result = split_travel_plans(response.choices[0].message.content)
 
                 # Verify JSON serialization
                 json.dumps(result)  # Will raise JSONDecodeError if invalid
@@ -92,22 +123,54 @@ def generate_travel_plan(message, user_preferences=None):
                 if attempt == MAX_RETRIES - 1:
                     raise
                 time.sleep(BACKOFF_FACTOR ** attempt)
-            except (APIError, APIConnectionError) as e:
-                logger.error(f"OpenAI API error: {str(e)}")
+            except APITimeoutError as e:
+                timeouts += 1
+                if timeouts >= MAX_TIMEOUT_ATTEMPTS or attempt == MAX_RETRIES - 1:
+                    logger.error("OpenAI request timed out: %s", e)
+                    raise Exception("Failed to generate travel plan: OpenAI timed out")
+                logger.warning("OpenAI timed out on attempt %s, retrying", attempt + 1)
+                time.sleep(BACKOFF_FACTOR ** attempt)
+            except (APIConnectionError, InternalServerError) as e:
+                # Dropped connections and 5xx are worth another try
+                if attempt == MAX_RETRIES - 1:
+                    logger.error("OpenAI API error: %s", e)
+                    raise Exception("Failed to generate travel plan due to API error")
+                logger.warning("Transient OpenAI error on attempt %s: %s", attempt + 1, e)
+                time.sleep(BACKOFF_FACTOR ** attempt)
+            except APIError as e:
+                logger.error("OpenAI API error: %s", e)
                 raise Exception("Failed to generate travel plan due to API error")
 
+    except RateLimitError:
+        # Let callers answer with a 429 rather than a generic failure
+        raise
     except Exception as e:
-        logger.error(f"Error in generate_travel_plan: {str(e)}")
+        logger.error("Error in generate_travel_plan: %s", e)
         raise Exception(f"Failed to generate travel plan: {str(e)}")
 
+def stream_travel_plan(message, user_preferences=None):
+    """Yield travel plan text from OpenAI as it is generated"""
+    # No retry loop: once text has reached the client a retry can't be spliced in.
+    # The SDK may still retry the initial request, before anything is sent.
+    stream = client.with_options(max_retries=2).chat.completions.create(
+        model=DEFAULT_MODEL,
+        messages=build_plan_messages(message, user_preferences),
+        temperature=0.7,
+        max_tokens=2000,
+        stream=True
+    )
+    for chunk in stream:
+        if chunk.choices and chunk.choices[0].delta.content:
+            yield chunk.choices[0].delta.content
+
 def analyze_user_preferences(query: str, selected_response: str):
     """
     Analyze user preferences based on their query and selected response
     """
     logger.debug("Starting preference analysis")
-    logger.debug(f"Using model: {DEFAULT_MODEL}")
-    logger.debug(f"Query: {query}")
-    logger.debug(f"Selected response length: {len(selected_response)}")
+    logger.debug("Using model: %s", DEFAULT_MODEL)
+    logger.debug("Query: %s", query)
+    logger.debug("Selected response length: %s", len(selected_response))
 
     try:
         # Get the preference analyzer agent
@@ -141,7 +204,8 @@ def analyze_user_preferences(query: str, selected_response: str):
         logger.debug(
             "Making OpenAI API call for preference analysis with retry mechanism"
         )
-        response = make_api_call_with_retry(
+        # make_api_call_with_retry returns the validated message content
+        analysis_result = make_api_call_with_retry(
             client.chat.completions.create,
             model=DEFAULT_MODEL,
             messages=[{
@@ -155,13 +219,11 @@ def analyze_user_preferences(query: str, selected_response: str):
             temperature=0.3  # Lower temperature for more consistent analysis
         )
 
-        analysis_result = response.choices[0].message.content
-        logger.debug(
-            f"Received preference analysis (length: {len(analysis_result)})")
+        logger.debug("Received preference analysis (length: %s)", len(analysis_result))
         return analysis_result
 
     except Exception as e:
-        logger.error(f"Error analyzing preferences: {str(e)}", exc_info=True)
+        logger.error("Error analyzing preferences: %s", e, exc_info=True)
         raise Exception(f"Failed to analyze preferences: {str(e)}")
 
 def validate_openai_response(response):
@@ -189,35 +251,23 @@ def make_api_call_with_retry(func, *args, **kwargs):
         except RateLimitError as e:
             retry_count += 1
             if retry_count > MAX_RETRIES:
-                logger.error(f"Max retries ({MAX_RETRIES}) exceeded for rate limit")
+                logger.error("Max retries (%s) exceeded for rate limit", MAX_RETRIES)
                 raise Exception("Service is experiencing high traffic. Please try again in a few minutes.")
 
             delay = min(BASE_DELAY * (2 ** (retry_count - 1)), MAX_DELAY)
             jitter_amount = random.uniform(-JITTER * delay, JITTER * delay)
             final_delay = delay + jitter_amount
 
-            logger.warning(f"Rate limit hit, attempt {retry_count}/{MAX_RETRIES}. Retrying in {final_delay:.2f} seconds...")
+            logger.warning("Rate limit hit, attempt %s/%s. Retrying in %.2f seconds...", retry_count, MAX_RETRIES, final_delay)
             time.sleep(final_delay)
         except (APIError, APIConnectionError) as e:
             retry_count += 1
             if retry_count > MAX_RETRIES:
-                logger.error(f"Max retries ({MAX_RETRIES}) exceeded for API error")
+                logger.error("Max retries (%s) exceeded for API error", MAX_RETRIES)
                 raise Exception("API service error. Please try again later.")
 
             delay = min(BASE_DELAY * (2 ** (retry_count - 1)), MAX_DELAY)
-            logger.warning(f"API error, attempt {retry_count}/{MAX_RETRIES}. Retrying in {delay} seconds... Error: {str(e)}")
+            logger.warning("API error, attempt %s/%s. Retrying in %s seconds... Error: %s", retry_count, MAX_RETRIES, delay, e)
             time.sleep(delay)
 
-#OpenAI Configuration
-DEFAULT_MODEL = "gpt-3.5-turbo"  # Using gpt-3.5-turbo as specified
-DEFAULT_TEMPERATURE = 0.7
-MAX_TOKENS_ITINERARY = 2000
-MAX_TOKENS_ANALYSIS = 1000
-
-# Retry Configuration
-MAX_RETRIES = 5
-BASE_DELAY = 1  # Initial delay in seconds
-MAX_DELAY = 32  # Maximum delay in seconds
-JITTER = 0.1  # Random jitter factor
-
 agent_registry = AgentRegistry()
\ No newline at end of file
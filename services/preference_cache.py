@@ -0,0 +1,25 @@
+import threading
+from typing import Callable, Dict, Optional
+from cachetools import TTLCache
+
+# Preferences change rarely and saves invalidate explicitly, so keep them
+# per process; chat refinement loops otherwise hit Airtable on every message.
+_cache = TTLCache(maxsize=10000, ttl=300)
+_lock = threading.Lock()
+_MISSING = object()
+
+def get_or_load(user_id: str, loader: Callable[[str], Optional[Dict]]) -> Optional[Dict]:
+    """Return a user's preferences (or None), calling loader on a cache miss"""
+    with _lock:
+        prefs = _cache.get(user_id, _MISSING)
+    if prefs is _MISSING:
+        # Lookup errors propagate and are not cached; "no preferences" is
+        prefs = loader(user_id)
+        with _lock:
+            _cache[user_id] = prefs
+    return prefs
+
+def invalidate(user_id: str):
+    """Forget a user's cached preferences after they change"""
+    with _lock:
+        _cache.pop(user_id, None)
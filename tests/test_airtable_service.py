@@ -0,0 +1,75 @@
+import unittest
+from datetime import datetime
+from unittest import mock
+
+try:
+    from services import airtable_service
+except ImportError:  # pyairtable isn't installed
+    airtable_service = None
+
+
+@unittest.skipIf(airtable_service is None, "pyairtable is not installed")
+class SaveUserPreferencesTest(unittest.TestCase):
+    def setUp(self):
+        env = {"AIRTABLE_ACCESS_TOKEN": "token", "AIRTABLE_BASE_ID": "appBase"}
+        with mock.patch.dict("os.environ", env), \
+                mock.patch.object(airtable_service, "Api"), \
+                mock.patch.object(airtable_service, "_background_executor"):
+            self.service = airtable_service.AirtableService()
+        self.table = self.service.preferences_table
+
+        patcher = mock.patch.object(airtable_service, "datetime")
+        fake_datetime = patcher.start()
+        fake_datetime.now.return_value = datetime(2024, 5, 1)
+        self.addCleanup(patcher.stop)
+
+    def test_batch_upsert_writes_only_given_preferences(self):
+        self.service.batch_save_user_preferences({
+            "1": {"budget": "mid", "travel_style": "relaxed"},
+            "2": {"budget": "luxury"},
+        })
+
+        self.table.batch_upsert.assert_called_once_with(
+            [
+                {"fields": {
+                    "User ID": "1",
+                    "Budget Preference": "mid",
+                    "Travel Style": "relaxed",
+                    "Last Updated Date": "2024-05-01",
+                }},
+                # No travel style given, so the stored one is left alone
+                {"fields": {
+                    "User ID": "2",
+                    "Budget Preference": "luxury",
+                    "Last Updated Date": "2024-05-01",
+                }},
+            ],
+            key_fields=["User ID"],
+        )
+
+    def test_single_save_keeps_preference_fields(self):
+        self.table.all.return_value = []
+
+        self.service.save_user_preferences("1", {"budget": "mid", "travel_style": "relaxed"})
+
+        self.table.create.assert_called_once_with({
+            "User ID": "1",
+            "Budget Preference": "mid",
+            "Travel Style": "relaxed",
+            "Last Updated Date": "2024-05-01",
+        })
+
+    def test_update_leaves_missing_preferences_alone(self):
+        self.table.all.return_value = [{"id": "rec1"}]
+
+        self.service.save_user_preferences("1", {"budget": "mid"})
+
+        self.table.update.assert_called_once_with("rec1", {
+            "User ID": "1",
+            "Budget Preference": "mid",
+            "Last Updated Date": "2024-05-01",
+        })
+
+
+if __name__ == "__main__":
+    unittest.main()